@@ -1,38 +1,44 @@
 """Modernized Inventory-MCP Server"""
 import logging
 import os
-from contextvars import ContextVar
-from typing import Annotated, Any
+from contextlib import asynccontextmanager
+from typing import Annotated
 
 # Google Imports
+import grpc
 import google.cloud.asset_v1 as asset_v1
-from google.oauth2.credentials import Credentials
-from google.protobuf.json_format import MessageToDict
+from google.cloud.asset_v1.services.asset_service.transports import AssetServiceGrpcAsyncIOTransport
 
 # FastMCP Imports
-from fastmcp import FastMCP
+from fastmcp import Context, FastMCP
+from pydantic import Field
 from starlette.middleware import Middleware
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.cors import CORSMiddleware
-from starlette.requests import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 # Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("mcp-inventory")
 
 # --- AUTH CONTEXT ---
-request_auth_token: ContextVar[str | None] = ContextVar("request_auth_token", default=None)
-
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-            request_auth_token.set(token)
-        else:
-            request_auth_token.set(None)
-        
-        return await call_next(request)
+# The token rides on request.state (backed by the ASGI scope), which tools reach
+# through their injected Context.
+
+class AuthMiddleware:
+    """Pure ASGI middleware: BaseHTTPMiddleware would spin up a task group and a
+    memory stream per request just to read one header."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            for key, value in scope["headers"]:
+                if key == b"authorization" and value.startswith(b"Bearer "):
+                    scope.setdefault("state", {})["bearer_token"] = value[7:].decode("latin-1")
+                    break
+
+        await self.app(scope, receive, send)
 
 # Define Middleware upfront
 middleware = [
@@ -45,25 +51,64 @@ middleware = [
     Middleware(AuthMiddleware)
 ]
 
+# --- CHANNELS ---
+# One long-lived channel for the whole process, so DNS, TLS and HTTP/2 setup
+# happen at startup instead of inside a tool call. The channel carries no identity;
+# each RPC authenticates with the caller's token via auth_metadata().
+ASSET_HOST = "cloudasset.googleapis.com:443"
+CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.max_receive_message_length", 16 * 1024 * 1024),
+    # Asset payloads are mostly repeated resource names and project paths
+    ("grpc.default_compression_algorithm", grpc.Compression.Gzip),
+]
+
+_channels: dict[str, grpc.aio.Channel] = {}
+_clients: dict[str, asset_v1.AssetServiceAsyncClient] = {}
+
+def _get_channel(host: str) -> grpc.aio.Channel:
+    channel = _channels.get(host)
+    if channel is None:
+        channel = grpc.aio.secure_channel(host, grpc.ssl_channel_credentials(), options=CHANNEL_OPTIONS)
+        _channels[host] = channel
+    return channel
+
+def _get_asset_client() -> asset_v1.AssetServiceAsyncClient:
+    client = _clients.get(ASSET_HOST)
+    if client is None:
+        transport = AssetServiceGrpcAsyncIOTransport(channel=_get_channel(ASSET_HOST))
+        client = _clients[ASSET_HOST] = asset_v1.AssetServiceAsyncClient(transport=transport)
+    return client
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    # Start connecting now; the handshake completes in the background before the first call
+    _get_channel(ASSET_HOST).get_state(try_to_connect=True)
+    try:
+        yield
+    finally:
+        for channel in _channels.values():
+            await channel.close()
+        _channels.clear()
+        _clients.clear()
+
 # Initialize
-mcp = FastMCP("GCP-Inventory")
+mcp = FastMCP("GCP-Inventory", lifespan=lifespan)
 
 # --- HELPERS ---
 
-def get_token(explicit_token: str | None = None) -> str:
-    """Get token from explicit argument or request context."""
-    if explicit_token:
-        return explicit_token
-    
-    ctx_token = request_auth_token.get()
-    if ctx_token:
-        return ctx_token
-        
-    raise ValueError("Authentication required: No Bearer token provided in header or arguments.")
+def auth_metadata(token: str | None = None, ctx: Context | None = None) -> tuple[tuple[str, str], ...]:
+    """Per-RPC metadata carrying the caller's token over the shared channel.
 
-def create_creds(token: str | None = None) -> Credentials:
-    final_token = get_token(token)
-    return Credentials(token=final_token)
+    The token comes from the explicit argument or, failing that, the request context.
+    """
+    if not token:
+        request_context = ctx.request_context if ctx else None
+        request = request_context.request if request_context else None
+        token = getattr(request.state, "bearer_token", None) if request else None
+    if not token:
+        raise ValueError("Authentication required: No Bearer token provided in header or arguments.")
+    return (("authorization", f"Bearer {token}"),)
 
 # --- TOOLS ---
 
@@ -71,10 +116,11 @@ def create_creds(token: str | None = None) -> Credentials:
 async def search_assets(
     query: str, 
     scope: str = "organizations/123456789", 
-    asset_types: list[str] = ["compute.googleapis.com/Instance"],
-    page_size: int = 50,
-    page_token: str = None,
-    token: str = None
+    asset_types: tuple[str, ...] = ("compute.googleapis.com/Instance",),
+    page_size: Annotated[int, Field(ge=1, le=500)] = 50,
+    page_token: str | None = None,
+    token: str | None = None,
+    ctx: Context | None = None
 ) -> dict:
     """Search for GCP assets using Cloud Asset Inventory.
     
@@ -84,64 +130,61 @@ async def search_assets(
             "next_page_token": str | None
         }
     """
-    creds = create_creds(token)
-    client = asset_v1.AssetServiceAsyncClient(credentials=creds)
+    metadata = auth_metadata(token, ctx)
+    client = _get_asset_client()
     request = asset_v1.SearchAllResourcesRequest(
         scope=scope,
         query=query,
-        asset_types=asset_types,
+        asset_types=list(asset_types),
         page_size=page_size,
         page_token=page_token
     )
     
-    results = []
-    # Using the raw response to get the token, manual iteration for page
-    page_result = await client.search_all_resources(request=request)
-    # The async iterator flattens pages. We need strictly ONE page.
-    # Actually, the python client usually auto-pages. 
-    # To Control page size strictly and get token, we use `byte_stream` or just `pages` property if available?
-    # AssetServiceAsyncClient.search_all_resources returns SearchAllResourcesPager
-    # We can iterate 'pages' property on it? No, async pager is slightly different.
-    
-    # Correct Paging in Google Async Client:
-    # The `await client.search_all_resources` returns an AsyncPager. 
-    # Calling `responses` roughly gives access to pages?
-    # Simpler: The client abstracts pages. BUT we want to stop after one page and give the token.
-    # Workaround: We rely on the request `page_size`. The client *should* fetch one page if we iterate, 
-    # but `async for` will fetch next.
-    # We can use `pages` property of the pager.
-    
-    # Standard Paging Pattern for Async Pagers in Python:
-    # async for page in await client.search_all_resources(request=request).pages:
-    #     ... process page ...
-    #     next_token = page.next_page_token
-    #     break
-    
-    pager = await client.search_all_resources(request=request)
-    
-    # Correct way to get a single page from AsyncPager
-    async for page in pager.pages:
-        for resource in page.search_all_resources_response.results:
-            results.append({
+    # Paging: the awaited AsyncPager already holds the first response, and only
+    # `async for` over it (or `.pages`) fetches the next one. Reading that response
+    # directly returns exactly ONE page with nothing else buffered; the caller asks
+    # for more with next_page_token.
+    pager = await client.search_all_resources(request=request, metadata=metadata)
+
+    return {
+        "resources": [
+            {
                 "name": resource.name,
                 "asset_type": resource.asset_type,
                 "display_name": resource.display_name,
                 "project": resource.project,
                 "state": resource.state,
-            })
-        
-        return {
-            "resources": results,
-            "next_page_token": page.next_page_token if page.next_page_token else None
-        }
-    
-    # If no pages
-    return {"resources": [], "next_page_token": None}
+            }
+            for resource in pager.results
+        ],
+        "next_page_token": pager.next_page_token or None,
+    }
+
+# --- APP ---
+# Built at import time so uvicorn can load it by import string in every worker process
+# Stateless: MCP sessions would live in one worker's memory, and a follow-up request
+# routed to another worker would 404, so no session state is kept between requests.
+app = mcp.http_app(middleware=middleware, stateless_http=True)
 
 # --- ENTRYPOINT ---
 
 if __name__ == "__main__":
     import uvicorn
-    # mcp.http_app() returns a fully configured Starlette app
-    app = mcp.http_app(middleware=middleware)
-    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)), lifespan="on")
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        # uvloop is not available on Windows; fall back to the stdlib loop
+        loop = "asyncio"
+
+    # Protobuf decoding is CPU-bound, so spread requests over one process per core.
+    # Each worker imports the module itself and opens its own channel in the lifespan.
+    uvicorn.run(
+        "inventory_mcp.server:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 8080)),
+        workers=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 2)),
+        lifespan="on",
+        loop=loop,
+        http="httptools",
+    )
@@ -1,25 +1,17 @@
 import pytest
-from unittest.mock import AsyncMock, patch
-from google.cloud import asset_v1
+from unittest.mock import patch
+from inventory_mcp import server
+
+@pytest.fixture(autouse=True)
+def reset_clients():
+    """Keeps clients (and mocks) cached by one test from leaking into the next."""
+    server._clients.clear()
+    server._channels.clear()
+    yield
+    server._clients.clear()
+    server._channels.clear()
 
 @pytest.fixture
 def mock_asset_client():
     with patch("inventory_mcp.server.asset_v1.AssetServiceAsyncClient") as MockClient:
-        mock_instance = MockClient.return_value
-        # Default behavior for search_all_resources: return an empty async iterator
-        
-        async def async_iter(items):
-            for item in items:
-                yield item
-
-        # Helper to set return value for search_all_resources
-        def set_results(items):
-            mock_instance.search_all_resources.return_value = async_iter(items)
-            
-        mock_instance.set_results = set_results
-        # Default empty results
-        set_results([])
-        
-        yield mock_instance
-
-
+        yield MockClient.return_value
@@ -1,71 +1,89 @@
 import pytest
-from unittest.mock import MagicMock, call
-from inventory_mcp.server import search_resources
+from unittest.mock import AsyncMock
+from google.cloud import asset_v1
+from google.cloud.asset_v1.services.asset_service.pagers import SearchAllResourcesAsyncPager
+from inventory_mcp.server import search_assets
+
+
+def make_pager(first_response, fetch_next):
+    """A real AsyncPager over `first_response`; `fetch_next` serves any later page."""
+    return SearchAllResourcesAsyncPager(
+        fetch_next,
+        asset_v1.SearchAllResourcesRequest(),
+        first_response,
+    )
+
 
 @pytest.mark.asyncio
-async def test_search_resources_valid_search(mock_asset_client):
-    # Setup mock data
-    mock_resource = MagicMock()
-    mock_resource.name = "//compute.googleapis.com/projects/p/zones/z/instances/i"
-    mock_resource.asset_type = "compute.googleapis.com/Instance"
-    mock_resource.location = "us-central1-a"
-    mock_resource.display_name = "test-instance"
-    
-    # Configure mock to return this resource
-    mock_asset_client.set_results([mock_resource])
-    
-    # Execute
-    results = await search_resources(
-        scope="projects/test-project",
+async def test_search_assets_valid_search(mock_asset_client):
+    response = asset_v1.SearchAllResourcesResponse(results=[
+        asset_v1.ResourceSearchResult(
+            name="//compute.googleapis.com/projects/p/zones/z/instances/i",
+            asset_type="compute.googleapis.com/Instance",
+            display_name="test-instance",
+            project="projects/123",
+            state="RUNNING",
+        ),
+    ])
+    mock_asset_client.search_all_resources = AsyncMock(
+        return_value=make_pager(response, AsyncMock())
+    )
+
+    result = await search_assets(
         query="name:test",
-        location="us-central1"
+        scope="projects/test-project",
+        token="test-token",
     )
-    
+
     # Verify inputs
-    mock_asset_client.search_all_resources.assert_called_once()
-    call_kwargs = mock_asset_client.search_all_resources.call_args[1]
-    request = call_kwargs["request"]
-    
-    assert request["scope"] == "projects/test-project"
-    assert "state=ACTIVE" in request["query"]
-    assert "location:us-central1" in request["query"]
-    assert "name:test" in request["query"]
-    assert request["page_size"] == 50
-    
+    request = mock_asset_client.search_all_resources.call_args.kwargs["request"]
+    assert request.scope == "projects/test-project"
+    assert request.query == "name:test"
+    assert list(request.asset_types) == ["compute.googleapis.com/Instance"]
+    assert request.page_size == 50
+
     # Verify output
-    assert len(results) == 1
-    assert results[0]["name"] == mock_resource.name
-    assert results[0]["assetType"] == mock_resource.asset_type
+    assert result["resources"] == [{
+        "name": "//compute.googleapis.com/projects/p/zones/z/instances/i",
+        "asset_type": "compute.googleapis.com/Instance",
+        "display_name": "test-instance",
+        "project": "projects/123",
+        "state": "RUNNING",
+    }]
+    assert result["next_page_token"] is None
+
 
 @pytest.mark.asyncio
-async def test_search_resources_pagination_limit(mock_asset_client):
-    # Setup mock data - 60 items
-    mock_items = []
-    for i in range(60):
-        m = MagicMock()
-        m.name = f"resource-{i}"
-        m.asset_type = "type"
-        m.location = "loc"
-        m.display_name = f"display-{i}"
-        mock_items.append(m)
-        
-    mock_asset_client.set_results(mock_items)
-    
-    # Execute
-    results = await search_resources(scope="projects/test")
-    
-    # Verify limit
-    assert len(results) == 50
-    assert results[0]["name"] == "resource-0"
-    assert results[49]["name"] == "resource-49"
+async def test_search_assets_returns_one_page(mock_asset_client):
+    first = asset_v1.SearchAllResourcesResponse(
+        results=[asset_v1.ResourceSearchResult(name=f"resource-{i}") for i in range(2)],
+        next_page_token="page-2",
+    )
+    fetch_next = AsyncMock(return_value=asset_v1.SearchAllResourcesResponse(
+        results=[asset_v1.ResourceSearchResult(name="resource-2")],
+    ))
+    mock_asset_client.search_all_resources = AsyncMock(
+        return_value=make_pager(first, fetch_next)
+    )
+
+    result = await search_assets(
+        query="", page_size=2, page_token="page-1", token="test-token"
+    )
+
+    # Only the first response is read; the caller pages on with next_page_token
+    assert [r["name"] for r in result["resources"]] == ["resource-0", "resource-1"]
+    assert result["next_page_token"] == "page-2"
+    fetch_next.assert_not_called()
+    request = mock_asset_client.search_all_resources.call_args.kwargs["request"]
+    assert request.page_token == "page-1"
+
 
 @pytest.mark.asyncio
-async def test_search_resources_empty(mock_asset_client):
-    # Setup mock data - empty
-    mock_asset_client.set_results([])
-    
-    # Execute
-    results = await search_resources(scope="projects/test")
-    
-    # Verify
-    assert len(results) == 0
+async def test_search_assets_empty(mock_asset_client):
+    mock_asset_client.search_all_resources = AsyncMock(
+        return_value=make_pager(asset_v1.SearchAllResourcesResponse(), AsyncMock())
+    )
+
+    result = await search_assets(query="", token="test-token")
+
+    assert result == {"resources": [], "next_page_token": None}
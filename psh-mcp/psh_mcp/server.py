@@ -1,39 +1,51 @@
 """Modernized PSH-MCP Server"""
+import asyncio
+import hashlib
+import itertools
 import logging
 import os
-from contextvars import ContextVar
-from typing import Annotated, Any
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Annotated, Any, Awaitable, Callable
 
 # Google Imports
+import grpc
 import google.cloud.asset_v1 as asset_v1
 import google.cloud.servicehealth_v1 as servicehealth_v1
-from google.oauth2.credentials import Credentials
-from google.protobuf.json_format import MessageToDict
+from google.cloud.asset_v1.services.asset_service.transports import AssetServiceGrpcAsyncIOTransport
+from google.cloud.servicehealth_v1.services.service_health.transports import ServiceHealthGrpcAsyncIOTransport
 
 # FastMCP Imports
-from fastmcp import FastMCP
+from fastmcp import Context, FastMCP
+from pydantic import Field
 from starlette.middleware import Middleware
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.middleware.cors import CORSMiddleware
-from starlette.requests import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 # Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("mcp-psh")
 
 # --- AUTH CONTEXT ---
-request_auth_token: ContextVar[str | None] = ContextVar("request_auth_token", default=None)
-
-class AuthMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        auth_header = request.headers.get("Authorization")
-        if auth_header and auth_header.startswith("Bearer "):
-            token = auth_header.split(" ")[1]
-            request_auth_token.set(token)
-        else:
-            request_auth_token.set(None)
-        
-        return await call_next(request)
+# The token rides on request.state (backed by the ASGI scope), which tools reach
+# through their injected Context.
+
+class AuthMiddleware:
+    """Pure ASGI middleware: BaseHTTPMiddleware would spin up a task group and a
+    memory stream per request just to read one header."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            for key, value in scope["headers"]:
+                if key == b"authorization" and value.startswith(b"Bearer "):
+                    scope.setdefault("state", {})["bearer_token"] = value[7:].decode("latin-1")
+                    break
+
+        await self.app(scope, receive, send)
 
 # Define Middleware upfront
 middleware = [
@@ -46,205 +58,346 @@ middleware = [
     Middleware(AuthMiddleware)
 ]
 
+# --- CHANNELS ---
+# One long-lived channel per API for the whole process, so DNS, TLS and HTTP/2 setup
+# happen at startup instead of inside a tool call. The channel carries no identity;
+# each RPC authenticates with the caller's token via auth_metadata().
+ASSET_HOST = "cloudasset.googleapis.com:443"
+HEALTH_HOST = "servicehealth.googleapis.com:443"
+CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.max_receive_message_length", 16 * 1024 * 1024),
+    # Asset and event payloads are mostly repeated resource names and prose
+    ("grpc.default_compression_algorithm", grpc.Compression.Gzip),
+]
+
+_channels: dict[str, grpc.aio.Channel] = {}
+_clients: dict[str, Any] = {}
+
+def _get_channel(host: str) -> grpc.aio.Channel:
+    channel = _channels.get(host)
+    if channel is None:
+        channel = grpc.aio.secure_channel(host, grpc.ssl_channel_credentials(), options=CHANNEL_OPTIONS)
+        _channels[host] = channel
+    return channel
+
+def _get_asset_client() -> asset_v1.AssetServiceAsyncClient:
+    client = _clients.get(ASSET_HOST)
+    if client is None:
+        transport = AssetServiceGrpcAsyncIOTransport(channel=_get_channel(ASSET_HOST))
+        client = _clients[ASSET_HOST] = asset_v1.AssetServiceAsyncClient(transport=transport)
+    return client
+
+def _get_health_client() -> servicehealth_v1.ServiceHealthAsyncClient:
+    client = _clients.get(HEALTH_HOST)
+    if client is None:
+        transport = ServiceHealthGrpcAsyncIOTransport(channel=_get_channel(HEALTH_HOST))
+        client = _clients[HEALTH_HOST] = servicehealth_v1.ServiceHealthAsyncClient(transport=transport)
+    return client
+
+@asynccontextmanager
+async def lifespan(server: FastMCP):
+    # Start connecting now; the handshake completes in the background before the first call
+    for host in (ASSET_HOST, HEALTH_HOST):
+        _get_channel(host).get_state(try_to_connect=True)
+    try:
+        yield
+    finally:
+        for channel in _channels.values():
+            await channel.close()
+        _channels.clear()
+        _clients.clear()
+
 # Initialize
-mcp = FastMCP("PSH-Monitor")
+mcp = FastMCP("PSH-Monitor", lifespan=lifespan)
 
 # --- DEPENDENCY INJECTION ---
 
 # --- HELPERS ---
 
-def get_token(explicit_token: str | None = None) -> str:
-    """Get token from explicit argument or request context."""
-    if explicit_token:
-        return explicit_token
-    
-    ctx_token = request_auth_token.get()
-    if ctx_token:
-        return ctx_token
-        
-    raise ValueError("Authentication required: No Bearer token provided in header or arguments.")
+def auth_metadata(token: str | None = None, ctx: Context | None = None) -> tuple[tuple[str, str], ...]:
+    """Per-RPC metadata carrying the caller's token over the shared channel.
+
+    The token comes from the explicit argument or, failing that, the request context.
+    """
+    if not token:
+        request_context = ctx.request_context if ctx else None
+        request = request_context.request if request_context else None
+        token = getattr(request.state, "bearer_token", None) if request else None
+    if not token:
+        raise ValueError("Authentication required: No Bearer token provided in header or arguments.")
+    return (("authorization", f"Bearer {token}"),)
 
-def create_creds(token: str | None = None) -> Credentials:
-    final_token = get_token(token)
-    return Credentials(token=final_token)
+# --- VALIDATION ---
+
+_PROJECT_RE = re.compile(r"^[a-z0-9-]{1,30}\Z")
+
+# --- RESULT CACHE ---
+# Events change on the order of minutes while agents may poll every few seconds, so
+# identical reads are served from memory for PSH_CACHE_TTL seconds (0 disables).
+# Keys include a digest of the caller's token: a result is only ever returned to the
+# token that was allowed to read it, and raw tokens are never kept as dict keys.
+CACHE_TTL = float(os.environ.get("PSH_CACHE_TTL", 30))
+CACHE_MAX_ENTRIES = 256
+
+_cache: dict[tuple, tuple[float, Any]] = {}
+
+def _caller_key(metadata: tuple[tuple[str, str], ...]) -> bytes:
+    return hashlib.blake2b(dict(metadata)["authorization"].encode(), digest_size=16).digest()
+
+async def _cached(key: tuple, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    now = time.monotonic()
+    hit = _cache.get(key)
+    if hit is not None:
+        if hit[0] > now:
+            return hit[1]
+        # Expired: drop it now rather than waiting for the cache to fill up
+        del _cache[key]
+
+    value = await fetch()
+    if CACHE_TTL > 0:
+        # Re-insert so dict order tracks age, then drop the oldest entry when full
+        _cache.pop(key, None)
+        if len(_cache) >= CACHE_MAX_ENTRIES:
+            del _cache[next(iter(_cache))]
+        _cache[key] = (now + CACHE_TTL, value)
+    return value
 
 # --- DATA HELPERS ---
 
+# STATE_UNSPECIFIED (0) is left out: MessageToDict omitted default enums, so it reads as None
+_EVENT_STATES = {state.value: state.name for state in servicehealth_v1.Event.State if state.value}
+
+def _json_time(msg, field: str) -> str | None:
+    """RFC 3339 string for a Timestamp field, or None when unset (as MessageToDict did)."""
+    return getattr(msg, field).ToJsonString() if msg.HasField(field) else None
+
 def _format_event_details(event_pb) -> dict:
     if hasattr(event_pb, "_pb"):
-        data = MessageToDict(event_pb._pb)
+        # Read the raw protobuf fields directly instead of a reflective MessageToDict walk.
+        # Unset strings read as "", so `or None` keeps the None that MessageToDict gave.
+        pb = event_pb._pb
+        timeline = [{
+            "time": _json_time(u, "update_time"),
+            "title": u.title or None,
+            "description": u.description or None,
+            "workaround": u.workaround or None,
+        } for u in pb.updates]
+        # One impact per (product, location), so keep each product once, in order
+        product_names = list(dict.fromkeys(
+            impact.product.product_name for impact in pb.event_impacts if impact.product.product_name
+        ))
+        name, title, last_updated = pb.name or None, pb.title or None, _json_time(pb, "update_time")
+        state = _EVENT_STATES.get(pb.state)
     else:
         data = event_pb if isinstance(event_pb, dict) else {}
 
-    raw_updates = data.get("updates", [])
-    timeline = []
-    for update in raw_updates:
-        timeline.append({
+        timeline = [{
             "time": update.get("updateTime"),
             "title": update.get("title"),
             "description": update.get("description"),
             "workaround": update.get("workaround"),
-        })
-    timeline.sort(key=lambda x: x.get("time", ""), reverse=True)
+        } for update in data.get("updates", [])]
+
+        products = data.get("impactedProducts", [])
+        product_names = [p.get("productName") for p in products]
+        name, title, last_updated = data.get("name"), data.get("title"), data.get("updateTime")
+        state = data.get("state")
 
-    products = data.get("impactedProducts", [])
-    product_names = [p.get("productName") for p in products]
+    # Most events carry a single update, which needs no sort at all. Every entry has a
+    # "time" key, but it is None for updates without a timestamp, hence the `or ""`.
+    if len(timeline) > 1:
+        timeline.sort(key=lambda x: x["time"] or "", reverse=True)
 
     return {
-        "id": data.get("name"),
-        "title": data.get("title"),
-        "state": data.get("state"),
-        "last_updated": data.get("updateTime"),
+        "id": name,
+        "title": title,
+        "state": state,
+        "last_updated": last_updated,
         "impacted_products": product_names,
         "timeline": timeline,
         "latest_workaround": timeline[0].get("workaround") if timeline else None,
     }
 
+async def _take(pages, field: str, limit: int) -> list:
+    """First `limit` items of a pager's `field`, a page at a time, without fetching past them."""
+    items = []
+    async for page in pages:
+        # islice, not a slice: slicing a proto-plus repeated field returns raw _pb messages
+        items.extend(itertools.islice(getattr(page, field), limit - len(items)))
+        if len(items) >= limit:
+            break
+    return items
+
+async def _fetch_event_details(client, event_name: str, metadata) -> dict:
+    async def fetch() -> dict:
+        if "organizationEvents" in event_name:
+            request = servicehealth_v1.GetOrganizationEventRequest(name=event_name)
+            event = await client.get_organization_event(request=request, metadata=metadata)
+        else:
+            request = servicehealth_v1.GetEventRequest(name=event_name)
+            event = await client.get_event(request=request, metadata=metadata)
+        return _format_event_details(event)
+
+    return await _cached(("event", event_name, _caller_key(metadata)), fetch)
+
 # --- TOOLS ---
 
+MAX_EVENTS = 10
+# Upper bound for max_events, and so for batches built from a listing
+MAX_EVENTS_LIMIT = 100
+
 @mcp.tool()
 async def list_active_events(
     project_id: str, 
     location: str = "global",
-    token: str = None
+    max_events: Annotated[int, Field(ge=1, le=MAX_EVENTS_LIMIT)] = MAX_EVENTS,
+    token: str | None = None,
+    ctx: Context | None = None
 ) -> list[dict]:
     """List active health events (outages/maintenance) for a project."""
-    creds = create_creds(token)
-    if not project_id.replace("-", "").isalnum():
-         raise ValueError("Invalid project_id. Must be lowercase alphanumeric.")
+    if not _PROJECT_RE.match(project_id):
+        raise ValueError("Invalid project_id. Must be 1-30 lowercase letters, digits or hyphens.")
 
-    client = servicehealth_v1.ServiceHealthAsyncClient(credentials=creds)
+    metadata = auth_metadata(token, ctx)
+    client = _get_health_client()
     parent = f"projects/{project_id}/locations/{location}"
-    request = servicehealth_v1.ListEventsRequest(parent=parent, filter="state = ACTIVE")
+    request = servicehealth_v1.ListEventsRequest(
+        parent=parent, filter="state = ACTIVE", page_size=max_events
+    )
     
-    events = []
-    async for event in await client.list_events(request=request):
-        events.append(_format_event_details(event))
-        if len(events) >= 10: break
-    return events
+    async def fetch() -> list[dict]:
+        pager = await client.list_events(request=request, metadata=metadata)
+        return [_format_event_details(event) for event in await _take(pager.pages, "events", max_events)]
+
+    return await _cached(("events", parent, max_events, _caller_key(metadata)), fetch)
 
 @mcp.tool()
 async def list_org_events(
     organization_id: str,
-    token: str = None
+    max_events: Annotated[int, Field(ge=1, le=MAX_EVENTS_LIMIT)] = MAX_EVENTS,
+    token: str | None = None,
+    ctx: Context | None = None
 ) -> list[dict]:
     """List active health events across the entire Organization."""
-    creds = create_creds(token)
-    client = servicehealth_v1.ServiceHealthAsyncClient(credentials=creds)
+    metadata = auth_metadata(token, ctx)
+    client = _get_health_client()
     parent = f"organizations/{organization_id}/locations/global"
-    request = servicehealth_v1.ListOrganizationEventsRequest(parent=parent, filter="state = ACTIVE")
+    request = servicehealth_v1.ListOrganizationEventsRequest(
+        parent=parent, filter="state = ACTIVE", page_size=max_events
+    )
     
-    events = []
-    async for event in await client.list_organization_events(request=request):
-        events.append(_format_event_details(event))
-        if len(events) >= 10: break
-    return events
+    async def fetch() -> list[dict]:
+        pager = await client.list_organization_events(request=request, metadata=metadata)
+        return [_format_event_details(event) for event in await _take(pager.pages, "organization_events", max_events)]
+
+    return await _cached(("events", parent, max_events, _caller_key(metadata)), fetch)
 
 @mcp.tool()
 async def get_event_details(
     event_name: str,
-    token: str = None
+    token: str | None = None,
+    ctx: Context | None = None
 ) -> dict:
     """Get full narrative, timeline, and workarounds for a specific event."""
-    creds = create_creds(token)
-    client = servicehealth_v1.ServiceHealthAsyncClient(credentials=creds)
-    if "organizationEvents" in event_name:
-        request = servicehealth_v1.GetOrganizationEventRequest(name=event_name)
-        event = await client.get_organization_event(request=request)
-    else:
-        request = servicehealth_v1.GetEventRequest(name=event_name)
-        event = await client.get_event(request=request)
-    return _format_event_details(event)
+    metadata = auth_metadata(token, ctx)
+    return await _fetch_event_details(_get_health_client(), event_name, metadata)
+
+@mcp.tool()
+async def get_events_details_batch(
+    event_names: Annotated[list[str], Field(min_length=1, max_length=MAX_EVENTS_LIMIT)],
+    token: str | None = None,
+    ctx: Context | None = None
+) -> list[dict]:
+    """Get details for several events at once, in the order given.
+
+    Prefer this over repeated get_event_details calls, e.g. for every event
+    returned by list_active_events.
+    """
+    metadata = auth_metadata(token, ctx)
+    client = _get_health_client()
+    # The lookups are independent, so run them as parallel streams on the shared channel
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(_fetch_event_details(client, name, metadata)) for name in event_names]
+    except ExceptionGroup as group:
+        # Surface the real error (e.g. NotFound) rather than "unhandled errors in a TaskGroup"
+        raise group.exceptions[0]
+    return [task.result() for task in tasks]
 
 @mcp.tool()
 async def list_projects_without_service_health(
     scope: str,
-    max_projects: int = 50,
-    token: str = None
+    max_projects: Annotated[int, Field(ge=1, le=500)] = 50,
+    token: str | None = None,
+    ctx: Context | None = None
 ) -> dict:
     """Audit an Organization to find projects where Service Health is disabled.
     
     Result limited by max_projects to prevent timeouts.
     """
-    creds = create_creds(token)
-    asset_client = asset_v1.AssetServiceAsyncClient(credentials=creds)
+    metadata = auth_metadata(token, ctx)
+    asset_client = _get_asset_client()
     
     # Safety Check
     if "organizations" in scope and max_projects > 100:
         raise ValueError("Safety Guard: max_projects limited to 100 for Organization scopes.")
 
     # 1. Get ALL active projects (Limited)
-    all_projects = []
     req_projects = asset_v1.SearchAllResourcesRequest(
         scope=scope, query="state=ACTIVE",
         asset_types=["cloudresourcemanager.googleapis.com/Project"], 
-        read_mask="name",
+        # `project` is what we diff on; without it in the mask every result reads ""
+        read_mask="name,project",
         page_size=max_projects
     )
-    
-    # We only fetch ONE page of projects to respect the limit safely
-    # This prevents the O(N) full scan risk
-    pager = await asset_client.search_all_resources(request=req_projects)
-    
-    projects_to_check = []
-    
-    async for page in pager.pages:
-        for p in page.search_all_resources_response.results:
-            projects_to_check.append(p.project)
-        break # STOP after first page (max_projects)
-        
-    if not projects_to_check:
-        return {"disabled_projects": [], "warning": "No active projects found in scope."}
 
-    # 2. Check Service Health status for these specific projects
-    # We can't batch query easily, but we can query by parent?
-    # Actually, SearchAll is efficient. We can just search for the enabled service
-    # NO, we need to know where it is MISSING.
-    # Efficient Set Difference on the limited subset:
-    
-    enabled_projects = set()
-    # Query ONLY the projects we found? 
-    # "project:A OR project:B ..." might be too long.
-    # We just search the same scope for the enabled service, but limited?
-    # No, that might return projects we didn't list in step 1.
-    
-    # Optimization: We already have a list of candidate projects.
-    # We will search for enabled services in the SAME scope, but we can't easily filter to just our 50 candidates
-    # without a massive query string.
-    # Strategy: Fetch enabled services in the same scope (also limited/paged) and set difference?
+    # 2. Check Service Health status for the same scope
+    # We can't batch query "project:A OR project:B ..." (too long), so we search the
+    # same scope for the enabled service and take the set difference.
     # Risk: If enabled services are on page 2, but we only checked page 1 of projects...
-    
     # Correct Small-Scale Audit Strategy (The L6 way for this simplified tool):
-    # Iterate the *candidate* projects and check specific API enablement? Too slow (N calls).
-    # Better: Just accept that this tool returns "Disabled projects found in the first N projects scanned".
-    
+    # Just accept that this tool returns "Disabled projects found in the first N projects scanned".
     req_enabled = asset_v1.SearchAllResourcesRequest(
         scope=scope, 
         query="name:servicehealth.googleapis.com", # Find the enabled API resource
         asset_types=["serviceusage.googleapis.com/Service"],
         page_size=1000 # Fetch more enabled markers to cover our project range hopefully
     )
-    
-    # We fetch enough enabled markers to be reasonably sure. 
-    # NOTE: This is still imperfect distributed consistency, but better than O(N) crash.
-    async for page in await asset_client.search_all_resources(request=req_enabled):
-         for result in page.search_all_resources_response.results:
-             # name format: //serviceusage.googleapis.com/projects/{PROJECT_NUMBER}/services/servicehealth.googleapis.com
-             # BUT SearchAllResources returns `project` field usually formatted as `projects/123...`
-             if result.project:
-                 enabled_projects.add(result.project) # format: projects/12345
-                 
-             # Fallback for display_name or name parsing if project field empty (rare in search)
-    
-    # The `projects_to_check` are `projects/123...` (numbers or IDs?)
-    # Asset Inventory usually returns `projects/NUMBER` in `.project` field for resources.
-    # But for Project resource itself, `.project` field is empty? No, `.name` is `//cloudresourcemanager.../projects/NUMBER`
-    
-    disabled = []
-    for p in projects_to_check:
-        # P is likely `projects/number`
-        if p not in enabled_projects:
-            disabled.append(p)
+
+    async def fetch_projects() -> set[str]:
+        # We only fetch ONE page of projects to respect the limit safely
+        # This prevents the O(N) full scan risk
+        pager = await asset_client.search_all_resources(request=req_projects, metadata=metadata)
+        async for page in pager.pages:
+            return {p.project for p in page.results if p.project}
+        return set()
+
+    async def fetch_enabled() -> set[str]:
+        # NOTE: This is still imperfect distributed consistency, but better than O(N) crash.
+        pager = await asset_client.search_all_resources(request=req_enabled, metadata=metadata)
+        # name format: //serviceusage.googleapis.com/projects/{PROJECT_NUMBER}/services/servicehealth.googleapis.com
+        # BUT SearchAllResources returns `project` field already formatted as `projects/12345`,
+        # so take it as-is rather than parsing the name.
+        return {
+            result.project
+            async for page in pager.pages
+            for result in page.results
+            if result.project
+        }
+
+    # The two scans are independent, so overlap them on the shared channel
+    # instead of paying latency(projects) + latency(enabled).
+    projects_task = asyncio.create_task(fetch_projects())
+    enabled_task = asyncio.create_task(fetch_enabled())
+    projects_to_check, enabled_projects = await asyncio.gather(projects_task, enabled_task)
+
+    if not projects_to_check:
+        return {"disabled_projects": [], "warning": "No active projects found in scope."}
+
+    # The `projects_to_check` are `projects/NUMBER`, same as the `.project` field of the services.
+    # Both sides are sets, so the diff runs in C; sorting keeps the output stable.
+    disabled = sorted(projects_to_check - enabled_projects)
 
     return {
         "disabled_projects": disabled,
@@ -252,23 +405,18 @@ async def list_projects_without_service_health(
         "warning": f"Scanned first {len(projects_to_check)} projects. Pass page_token (not impl yet) for more."
     }
 
+# --- APP ---
+# mcp.http_app() returns a Starlette app that already carries FastMCP's lifespan.
+# Built at import time so uvicorn can load it by import string in every worker process.
+# Stateless: MCP sessions would live in one worker's memory, and a follow-up request
+# routed to another worker would 404, so no session state is kept between requests.
+app = mcp.http_app(middleware=middleware, stateless_http=True)
+
 # --- ENTRYPOINT ---
 
 if __name__ == "__main__":
     import uvicorn
-    from contextlib import asynccontextmanager
-    
-    # Define explicit lifespan to initialize FastMCP
-    # REFACTORED: We now rely on uvicorn's lifespan="on" and FastMCP's internal handling.
-    # The previous manual wrapper is removed to reduce confusion.
-        
-    # mcp.http_app() returns a Starlette app, but we need to ensure lifespan is passed
-    # Re-wrap or attach lifespan if missing
-    app = mcp.http_app(middleware=middleware)
-    # FastMCP's http_app ALREADY has a lifespan, but it might depend on how uvicorn calls it.
-    # The error "Task group is not initialized" means the startup hook didn't run.
-    # We will FORCE it by ensuring uvicorn sees it.
-    
+
     # Debug version
     try:
         from fastmcp import __version__
@@ -276,5 +424,22 @@ if __name__ == "__main__":
     except ImportError:
         print("DEBUG: FastMCP Version: Unknown")
         
-    # Run with explicit lifespan arg to be safe
-    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)), lifespan="on")
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        # uvloop is not available on Windows; fall back to the stdlib loop
+        loop = "asyncio"
+
+    # Protobuf decoding is CPU-bound, so spread requests over one process per core.
+    # Each worker imports the module itself and opens its own channels in the lifespan.
+    # lifespan="on" makes uvicorn run FastMCP's startup hook (task group init) in each worker.
+    uvicorn.run(
+        "psh_mcp.server:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 8080)),
+        workers=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 2)),
+        lifespan="on",
+        loop=loop,
+        http="httptools",
+    )
@@ -1,5 +1,18 @@
 from unittest.mock import AsyncMock, MagicMock
 import pytest
+from psh_mcp import server
+
+
+@pytest.fixture(autouse=True)
+def reset_clients():
+  """Keeps clients (and mocks) cached by one test from leaking into the next."""
+  server._clients.clear()
+  server._channels.clear()
+  server._cache.clear()
+  yield
+  server._clients.clear()
+  server._channels.clear()
+  server._cache.clear()
 
 
 @pytest.fixture
@@ -1,5 +1,15 @@
-from unittest.mock import AsyncMock
-from psh_mcp.server import _format_event_details, list_active_events
+from unittest.mock import AsyncMock, MagicMock
+from google.api_core import exceptions
+from google.cloud import servicehealth_v1
+from google.protobuf import timestamp_pb2
+from psh_mcp import server
+from psh_mcp.server import (
+    _format_event_details,
+    get_event_details,
+    get_events_details_batch,
+    list_active_events,
+    list_org_events,
+)
 import pytest
 
 
@@ -14,17 +24,88 @@ def test_format_event_details(sample_event):
   assert result["timeline"][0]["description"] == "Investigating issue..."
 
 
+def test_format_event_details_from_proto():
+  """Verifies protobuf events are read field by field with the same output shape."""
+  event = servicehealth_v1.Event(
+      name="projects/123/locations/global/events/event-abc",
+      title="Packet Loss in us-central1",
+      state=servicehealth_v1.Event.State.ACTIVE,
+      update_time=timestamp_pb2.Timestamp(seconds=1704110400),
+      event_impacts=[{"product": {"product_name": "Cloud SQL"}}],
+      updates=[
+          {"update_time": {"seconds": 1704106800}, "workaround": "Retry"},
+          {"update_time": {"seconds": 1704108600}, "workaround": "Failover"},
+      ],
+  )
+
+  result = _format_event_details(event)
+
+  assert result["id"] == "projects/123/locations/global/events/event-abc"
+  assert result["state"] == "ACTIVE"
+  assert result["last_updated"] == "2024-01-01T12:00:00Z"
+  assert result["impacted_products"] == ["Cloud SQL"]
+  assert [u["time"] for u in result["timeline"]] == [
+      "2024-01-01T11:30:00Z",
+      "2024-01-01T11:00:00Z",
+  ]
+  assert result["latest_workaround"] == "Failover"
+
+
+def test_format_event_details_update_without_time():
+  """Verifies updates with no timestamp sort last instead of breaking the sort."""
+  event = servicehealth_v1.Event(
+      updates=[
+          {"workaround": "Unknown"},
+          {"update_time": {"seconds": 1704106800}, "workaround": "Retry"},
+      ],
+  )
+
+  result = _format_event_details(event)
+
+  assert [u["time"] for u in result["timeline"]] == ["2024-01-01T11:00:00Z", None]
+  assert result["latest_workaround"] == "Retry"
+
+
+def test_format_event_details_unset_fields_from_proto():
+  """Verifies unset proto fields read as None and products are listed once."""
+  event = servicehealth_v1.Event(
+      event_impacts=[
+          {"product": {"product_name": "SQL"}, "location": {"location_name": "us-east1"}},
+          {"product": {"product_name": "SQL"}, "location": {"location_name": "us-west1"}},
+          {"product": {"product_name": "GKE"}, "location": {"location_name": "us-east1"}},
+      ],
+      updates=[{"update_time": {"seconds": 1704106800}}],
+  )
+
+  result = _format_event_details(event)
+
+  assert result["id"] is None
+  assert result["title"] is None
+  assert result["state"] is None
+  assert result["impacted_products"] == ["SQL", "GKE"]
+  assert result["timeline"][0]["description"] is None
+  assert result["latest_workaround"] is None
+
+
 # --- Integration Tests: Logic Flow ---
 @pytest.mark.asyncio
 async def test_list_active_events_valid(mock_health_client, sample_event):
   """Verifies the tool calls the GCP API with correct filters."""
-  # Setup Mock
-  mock_iterator = AsyncMock()
-  mock_iterator.__aiter__.return_value = [sample_event]
-  mock_health_client.list_events.return_value = mock_iterator
+  # Setup Mock: an awaited pager whose pages yield one real ListEventsResponse
+  pager = MagicMock()
+  pager.pages.__aiter__.return_value = [
+      servicehealth_v1.ListEventsResponse(events=[servicehealth_v1.Event(
+          name=sample_event["name"],
+          title=sample_event["title"],
+          state=servicehealth_v1.Event.State.ACTIVE,
+      )]),
+  ]
+  mock_health_client.list_events = AsyncMock(return_value=pager)
 
   # Execute
-  events = await list_active_events(project_id="my-project", location="global")
+  events = await list_active_events(
+      project_id="my-project", location="global", token="test-token"
+  )
 
   # Assert
   assert len(events) == 1
@@ -40,3 +121,134 @@ async def test_list_active_events_security():
   """Verifies input validation blocks malicious project IDs."""
   with pytest.raises(ValueError, match="Invalid project_id"):
     await list_active_events(project_id="malicious; rm -rf /")
+
+
+@pytest.mark.asyncio
+async def test_get_events_details_batch(mock_health_client, sample_event):
+  """Verifies batched lookups route per event type and keep the input order."""
+  org_event = {**sample_event, "title": "Org-wide incident"}
+  mock_health_client.get_event = AsyncMock(return_value=sample_event)
+  mock_health_client.get_organization_event = AsyncMock(return_value=org_event)
+
+  events = await get_events_details_batch(
+      event_names=[
+          "organizations/1/locations/global/organizationEvents/a",
+          "projects/123/locations/global/events/event-abc",
+      ],
+      token="test-token",
+  )
+
+  assert [e["title"] for e in events] == [
+      "Org-wide incident",
+      "Packet Loss in us-central1",
+  ]
+  mock_health_client.get_event.assert_awaited_once()
+  mock_health_client.get_organization_event.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_get_events_details_batch_surfaces_lookup_error(mock_health_client, sample_event):
+  """Verifies a failed lookup raises its own error, not an ExceptionGroup."""
+  mock_health_client.get_event = AsyncMock(
+      side_effect=[sample_event, exceptions.NotFound("event-missing")]
+  )
+
+  with pytest.raises(exceptions.NotFound, match="event-missing"):
+    await get_events_details_batch(
+        event_names=[
+            "projects/123/locations/global/events/event-abc",
+            "projects/123/locations/global/events/event-missing",
+        ],
+        token="test-token",
+    )
+
+
+@pytest.mark.asyncio
+async def test_list_active_events_rejects_trailing_newline():
+  """Verifies the project_id check anchors at the true end of the string."""
+  with pytest.raises(ValueError, match="Invalid project_id"):
+    await list_active_events(project_id="my-project\n")
+
+
+@pytest.mark.asyncio
+async def test_list_active_events_limit(mock_health_client):
+  """Verifies max_events sizes the API page and caps the list across pages."""
+  def event(n):
+    return servicehealth_v1.Event(
+        name=f"projects/123/locations/global/events/event-{n}",
+        title=f"Incident {n}",
+        state=servicehealth_v1.Event.State.ACTIVE,
+        updates=[{"update_time": {"seconds": 1704106800}, "workaround": f"Fix {n}"}],
+    )
+
+  pager = MagicMock()
+  pager.pages.__aiter__.return_value = [
+      servicehealth_v1.ListEventsResponse(events=[event(1), event(2)]),
+      servicehealth_v1.ListEventsResponse(events=[event(3), event(4)]),
+  ]
+  mock_health_client.list_events = AsyncMock(return_value=pager)
+
+  events = await list_active_events(
+      project_id="my-project", max_events=3, token="test-token"
+  )
+
+  assert [e["title"] for e in events] == ["Incident 1", "Incident 2", "Incident 3"]
+  assert events[2]["id"] == "projects/123/locations/global/events/event-3"
+  assert events[2]["state"] == "ACTIVE"
+  assert events[2]["latest_workaround"] == "Fix 3"
+  _, kwargs = mock_health_client.list_events.call_args
+  assert kwargs["request"].page_size == 3
+
+
+@pytest.mark.asyncio
+async def test_get_event_details_cached_per_token(mock_health_client, sample_event):
+  """Verifies repeat reads are served from cache, but never across tokens."""
+  mock_health_client.get_event = AsyncMock(return_value=sample_event)
+  name = "projects/123/locations/global/events/event-abc"
+
+  first = await get_event_details(event_name=name, token="token-a")
+  second = await get_event_details(event_name=name, token="token-a")
+  await get_event_details(event_name=name, token="token-b")
+
+  assert first == second
+  assert mock_health_client.get_event.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_list_org_events_reads_wrapped_protos(mock_health_client):
+  """Verifies org events taken across real response pages keep their fields."""
+  pages = [
+      servicehealth_v1.ListOrganizationEventsResponse(organization_events=[
+          {"name": "organizations/1/locations/global/organizationEvents/a", "title": "A"},
+      ]),
+      servicehealth_v1.ListOrganizationEventsResponse(organization_events=[
+          {"name": "organizations/1/locations/global/organizationEvents/b", "title": "B"},
+          {"name": "organizations/1/locations/global/organizationEvents/c", "title": "C"},
+      ]),
+  ]
+  pager = MagicMock()
+  pager.pages.__aiter__.return_value = pages
+  mock_health_client.list_organization_events = AsyncMock(return_value=pager)
+
+  events = await list_org_events(organization_id="1", max_events=2, token="test-token")
+
+  assert [e["title"] for e in events] == ["A", "B"]
+  assert events[1]["id"] == "organizations/1/locations/global/organizationEvents/b"
+
+
+@pytest.mark.asyncio
+async def test_event_cache_hides_tokens_and_drops_expired(mock_health_client, sample_event, mocker):
+  """Verifies cache keys carry no raw token and expired entries are evicted on lookup."""
+  clock = mocker.patch("psh_mcp.server.time.monotonic", return_value=1000.0)
+  mock_health_client.get_event = AsyncMock(return_value=sample_event)
+  name = "projects/123/locations/global/events/event-abc"
+
+  await get_event_details(event_name=name, token="secret-token")
+  assert not any("secret-token" in str(part) for key in server._cache for part in key)
+
+  # Past the TTL the lookup evicts the stale entry even if the refetch fails
+  clock.return_value = 1000.0 + server.CACHE_TTL + 1
+  key = next(iter(server._cache))
+  with pytest.raises(RuntimeError):
+    await server._cached(key, AsyncMock(side_effect=RuntimeError))
+  assert key not in server._cache
@@ -1,7 +1,7 @@
 print("Starting test script")
 import unittest
 
-from src.server import _format_event_details
+from psh_mcp.server import _format_event_details
 
 
 class TestTransformation(unittest.TestCase):
@@ -33,44 +33,45 @@ class TestTransformation(unittest.TestCase):
         print("Transformation Test Passed!")
 
 
-import asyncio
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
 
 # Import the function to test
-from src.server import list_projects_without_service_health
+from psh_mcp.server import list_projects_without_service_health
+
 
+def _pager(*results):
+    """An awaited AsyncPager stand-in whose .pages yields one page of results."""
+    pager = MagicMock()
+    pager.pages.__aiter__.return_value = [MagicMock(results=list(results))]
+    return pager
 
-class TestAuditor(unittest.TestCase):
 
-    def test_audit_logic(self):
-        # We mock the AssetServiceClient
-        with patch("src.server.asset_v1.AssetServiceClient") as MockClient:
-            mock_instance = MockClient.return_value
+@pytest.mark.asyncio
+async def test_audit_logic(mock_asset_client):
+    # Response 1: List of Projects
+    mock_p1 = MagicMock(project="projects/100")
+    mock_p2 = MagicMock(project="projects/200")
 
-            # Mock Response 1: List of Projects
-            mock_p1 = MagicMock()
-            mock_p1.project = "projects/100"
-            mock_p2 = MagicMock()
-            mock_p2.project = "projects/200"
+    # Response 2: List of Enabled Services (Only Project 100 has it)
+    mock_s1 = MagicMock(project="projects/100")
+    mock_s1.name = "//serviceusage.googleapis.com/projects/100/services/servicehealth.googleapis.com"
 
-            # Mock Response 2: List of Enabled Services (Only Project 100 has it)
-            mock_s1 = MagicMock()
-            mock_s1.name = "//.../projects/100/services/servicehealth..."
+    # The two scans are issued in this order before either is awaited
+    mock_asset_client.search_all_resources = AsyncMock(
+        side_effect=[_pager(mock_p1, mock_p2), _pager(mock_s1)]
+    )
 
-            # Configure side_effect for the two sequential calls
-            mock_instance.search_all_resources.side_effect = [
-                [mock_p1, mock_p2],
-                [mock_s1],
-            ]
+    result = await list_projects_without_service_health("organizations/1", token="test-token")
 
-            # Run the function (it is technically sync in our implementation above)
-            # If we made it async, we would need asyncio.run()
-            # The asset client code above was sync, so we call directly:
-            result = asyncio.run(list_projects_without_service_health("orgs/1"))
+    # Expectation: Project 200 is missing the service
+    assert result["disabled_projects"] == ["projects/200"]
+    assert result["scanned_count"] == 2
 
-            # Expectation: Project 200 is missing the service
-            self.assertEqual(result, ["projects/200"])
-            print("Audit Logic Test Passed!")
+    # The projects scan must ask for `project`, or the API leaves it empty
+    projects_request = mock_asset_client.search_all_resources.call_args_list[0].kwargs["request"]
+    assert "project" in projects_request.read_mask.paths
 
 
 if __name__ == "__main__":